@@ -1,64 +1,311 @@
 import os
-import tempfile
 import random
 import json
+import hashlib
+import tempfile
 
+import numpy as np
+import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
+from matplotlib.colors import to_hex, to_rgb
 import networkx as nx
 from pyvis.network import Network
 
-from main import simulate, get_nodes, export_simulation_metrics
-from main import G as default_G
+from main import simulate, get_nodes, mark_verified, export_simulation_metrics
+from main import G as default_G, get_default_pos
+
+
+# pyvis >= 0.3.2 can render HTML in memory
+_HAS_GEN = hasattr(Network, "generate_html")
+
+INFECTED_COLOR = "red"
+UNINFECTED_COLOR = "#cccccc"
+UPDATE_MESSAGE = "infection-update"
+LARGE_GRAPH_NODES = 500
+LAYOUT_ITERATIONS = 50
+LARGE_LAYOUT_ITERATIONS = 20
+COARSEN_THRESHOLD = 2000
+SIGMA_DEFAULT_NODES = 3000
+RENDERERS = ["pyvis (small)", "sigma-webgl (large)"]
 
 
 # -------------------------
 # Helper function
 # -------------------------
-def nx_to_pyvis(G, infected_nodes, pos):
+def nx_to_pyvis(G, infected_vec, pos):
     net = Network(height="600px", width="100%", bgcolor="#ffffff", font_color="black", notebook=False)
-    
-    for n, data in G.nodes(data=True):
+    # Positions come from spring_layout and are fixed, so skip vis.js stabilization
+    net.set_options('{"physics": {"enabled": false}, "edges": {"smooth": false}, "nodes": {"shadow": false}}')
+    large = G.number_of_nodes() > LARGE_GRAPH_NODES
+
+    # Build the vis.js node/edge dicts directly instead of add_node/add_edge,
+    # which check membership against the full node list on every call
+    nodes_list = []
+    for i, (n, data) in enumerate(G.nodes(data=True)):
         x, y = pos[n]
-        color = "red" if n in infected_nodes else "#cccccc"
 
         if data.get("is_fact_checker", False):
             shape = "triangleDown"
         else:
-            shape = "dot" if data.get("identity_type") == "anonymous" else "star"
+            shape = "star" if data.get("is_verified", data.get("identity_type") == "verified") else "dot"
+
+        node = {
+            "id": n,
+            "label": str(n),
+            "color": INFECTED_COLOR if infected_vec[i] else UNINFECTED_COLOR,
+            "shape": shape,
+            "x": x * 200,
+            "y": y * 200,
+            "fixed": True,
+            "font": {"color": net.font_color}
+        }
+        if not large:
+            node["title"] = (f"Node {n}<br>"
+                             f"identity: {data.get('identity_type')}<br>"
+                             f"credulity: {data.get('credulity')}<br>"
+                             f"tendency_to_share: {data.get('tendency_to_share')}")
+        nodes_list.append(node)
+
+    # Like add_edge on pyvis' default undirected Network, keep only the first
+    # edge of a reciprocal pair
+    edges_list = []
+    seen = set()
+    for u, v, data in G.edges(data=True):
+        if (v, u) in seen:
+            continue
+        seen.add((u, v))
+        trust = data.get("trust_weight", 0.0)
+        edge = {"from": u, "to": v, "value": trust, "arrows": "to"}
+        if not large:
+            edge["title"] = f"trust_weight={trust}"
+        edges_list.append(edge)
+
+    net.nodes = nodes_list
+    net.edges = edges_list
+    net.node_ids = [node["id"] for node in nodes_list]
+    net.node_map = {node["id"]: node for node in nodes_list}
+
+    return net
+
+
+def communities_to_pyvis(H, pos):
+    net = Network(height="600px", width="100%", bgcolor="#ffffff", font_color="black", notebook=False)
+    net.set_options('{"physics": {"enabled": false}, "edges": {"smooth": false}, "nodes": {"shadow": false}}')
 
+    for c, data in H.nodes(data=True):
+        x, y = pos[c]
         net.add_node(
-            n,
-            label=str(n),
-            color=color,
-            title=f"Node {n}<br>"
-                  f"identity: {data.get('identity_type')}<br>"
-                  f"credulity: {data.get('credulity')}<br>"
-                  f"tendency_to_share: {data.get('tendency_to_share')}",
+            c,
+            label=str(data["size"]),
+            color=UNINFECTED_COLOR,
+            title=f"Community {c}<br>members: {data['size']}",
             x=x * 200,
             y=y * 200,
             fixed=True,
-            shape=shape
+            shape="dot",
+            value=data["size"]
         )
 
-    for u, v, data in G.edges(data=True):
-        trust = data.get("trust_weight", 0.0)
-        net.add_edge(u, v, value=trust, title=f"trust_weight={trust}", arrows="to")
+    for u, v, data in H.edges(data=True):
+        net.add_edge(u, v, value=data["trust_weight"], arrows="to")
 
     return net
 
 
+def render_sigma(G, infected_vec, pos, run_id):
+    """
+    Build a self-contained sigma.js (WebGL) page for `G`. It listens for the
+    same {id, color} updates as the pyvis view. `run_id` makes each run's page
+    unique so the browser reloads it instead of keeping a recolored iframe.
+    """
+    nodes = list(G.nodes)
+    xy = np.round(np.array([pos[n] for n in nodes]) * 200, 3)
+    data = {
+        "keys": nodes,
+        "xs": xy[:, 0].tolist(),
+        "ys": xy[:, 1].tolist(),
+        "colors": np.where(infected_vec, INFECTED_COLOR, UNINFECTED_COLOR).tolist(),
+        "sources": [u for u, _ in G.edges],
+        "targets": [v for _, v in G.edges],
+    }
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <script src="https://cdn.jsdelivr.net/npm/graphology@0.25.4/dist/graphology.umd.min.js"></script>
+    <script src="https://cdn.jsdelivr.net/npm/sigma@3.0.0/dist/sigma.min.js"></script>
+</head>
+<body style="margin: 0;">
+    <div id="sigma-container" style="width: 100%; height: 600px;"></div>
+    <script>
+        window.__run = {run_id};
+        const data = {json.dumps(data, default=str)};
+        const graph = new graphology.Graph();
+
+        for (let i = 0; i < data.keys.length; i++) {{
+            graph.addNode(data.keys[i], {{
+                x: data.xs[i], y: -data.ys[i], size: 3, color: data.colors[i], label: String(data.keys[i])
+            }});
+        }}
+        for (let i = 0; i < data.sources.length; i++) {{
+            graph.mergeEdge(data.sources[i], data.targets[i]);
+        }}
+
+        const renderer = new Sigma(graph, document.getElementById("sigma-container"));
+
+        window.addEventListener("message", function (event) {{
+            if (event.data && event.data.type === {json.dumps(UPDATE_MESSAGE)}) {{
+                event.data.updates.forEach(u => graph.setNodeAttribute(u.id, "color", u.color));
+            }}
+        }});
+    </script>
+</body>
+</html>
+"""
+
+
+def community_colors(infected_vec, membership, sizes):
+    """Blend from grey to red by the infected fraction of each community."""
+    frac = np.bincount(membership, weights=infected_vec, minlength=len(sizes)) / sizes
+    grey, red = np.array(to_rgb(UNINFECTED_COLOR)), np.array(to_rgb(INFECTED_COLOR))
+    return np.array([to_hex(grey + f * (red - grey)) for f in frac])
+
+
+def color_updates(ids, colors, shown=None):
+    """List {id, color} for every node whose color differs from `shown`."""
+    changed = range(len(ids)) if shown is None else np.flatnonzero(colors != shown)
+    return [{"id": ids[i], "color": colors[i]} for i in changed]
+
+
+def network_html(net):
+    if _HAS_GEN:
+        return net.generate_html(notebook=False)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "network.html")
+        net.save_graph(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+
+def graph_hash(G):
+    data = nx.node_link_data(G)
+    return hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@st.cache_data(show_spinner=False)
+def compute_layout(graph_key, _G):
+    # Fruchterman-Reingold cost is linear in the iteration count
+    iterations = LAYOUT_ITERATIONS if _G.number_of_nodes() <= LARGE_GRAPH_NODES else LARGE_LAYOUT_ITERATIONS
+    return nx.spring_layout(_G.to_undirected(), seed=42, iterations=iterations)
+
+
+@st.cache_data(show_spinner=False)
+def render_html(graph_key, infected_vec, _G, _pos):
+    net = nx_to_pyvis(_G, infected_vec, _pos)
+    return network_html(net)
+
+
+@st.cache_data(show_spinner=False)
+def coarsen_graph(graph_key, _G, _pos):
+    """
+    Collapse Louvain communities into meta-nodes sized by member count, with
+    edges weighted by the summed trust between communities. Returns the
+    community graph, its positions and each node's community (in G order).
+    """
+    communities = nx.community.louvain_communities(_G.to_undirected(), weight="trust_weight", seed=42)
+    community_of = {n: c for c, members in enumerate(communities) for n in members}
+
+    H = nx.DiGraph()
+    H_pos = {}
+    for c, members in enumerate(communities):
+        H.add_node(c, size=len(members))
+        H_pos[c] = np.mean([_pos[n] for n in members], axis=0)
+
+    for u, v, data in _G.edges(data=True):
+        cu, cv = community_of[u], community_of[v]
+        if cu == cv:
+            continue
+        if H.has_edge(cu, cv):
+            H[cu][cv]["trust_weight"] += data.get("trust_weight", 0.0)
+        else:
+            H.add_edge(cu, cv, trust_weight=data.get("trust_weight", 0.0))
+
+    membership = np.array([community_of[n] for n in _G.nodes])
+    return H, H_pos, membership
+
+
+@st.cache_data(show_spinner=False)
+def render_coarse_html(graph_key, _H, _pos):
+    net = communities_to_pyvis(_H, _pos)
+    return network_html(net)
+
+
+def with_update_hook(html, updates, run_id):
+    """
+    Append a script to the network HTML that applies the {id, color}
+    `updates` on load and any later ones posted by `send_update`. `run_id`
+    makes each run's page unique so the browser reloads it.
+    """
+    hook = f"""
+<script>
+    window.__run = {run_id};
+    window.__updates = {json.dumps(updates)};
+
+    network.body.data.nodes.update(window.__updates);
+
+    window.addEventListener("message", function (event) {{
+        if (event.data && event.data.type === {json.dumps(UPDATE_MESSAGE)}) {{
+            network.body.data.nodes.update(event.data.updates);
+        }}
+    }});
+</script>
+"""
+    return html.replace("</body>", hook + "</body>")
+
+
+def send_update(updates, timestep):
+    """Post node color updates to the sibling network iframe."""
+    message = {
+        "type": UPDATE_MESSAGE,
+        "updates": updates,
+        "timestep": timestep,
+    }
+    st.components.v1.html(f"""
+<script>
+    for (let i = 0; i < window.parent.frames.length; i++) {{
+        window.parent.frames[i].postMessage({json.dumps(message)}, "*");
+    }}
+</script>
+""", height=0)
+
+
 # -------------------------
 # Session state init
 # -------------------------
 if "results" not in st.session_state:
     st.session_state.results = None
+if "results_graph_key" not in st.session_state:
+    st.session_state.results_graph_key = None
 if "current_timestep" not in st.session_state:
     st.session_state.current_timestep = 0
 if "initial_infected" not in st.session_state:
     st.session_state.initial_infected = []
 if "pos" not in st.session_state:
     st.session_state.pos = None
+if "pos_key" not in st.session_state:
+    st.session_state.pos_key = None
+if "graph_key" not in st.session_state:
+    st.session_state.graph_key = None
+if "graph_source" not in st.session_state:
+    st.session_state.graph_source = None
+if "base_html" not in st.session_state:
+    st.session_state.base_html = None
+if "shown_colors" not in st.session_state:
+    st.session_state.shown_colors = None
+if "run_id" not in st.session_state:
+    st.session_state.run_id = 0
+if "base_renderer" not in st.session_state:
+    st.session_state.base_renderer = None
 
 
 # -------------------------
@@ -85,14 +332,34 @@ uploaded_file = st.sidebar.file_uploader("Upload network JSON", type="json")
 if uploaded_file is not None:
     data = json.load(uploaded_file)
     G = nx.node_link_graph(data)
+    mark_verified(G)
     st.sidebar.write(f"Loaded graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
 else:
     G = default_G
     st.sidebar.write(f"Using default network: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
 
-
-undirected_G = G.to_undirected()
-st.session_state.pos = nx.spring_layout(undirected_G, seed=42)
+graph_source = uploaded_file.file_id if uploaded_file is not None else "default"
+if st.session_state.graph_source != graph_source:
+    st.session_state.graph_key = graph_hash(G)
+    st.session_state.graph_source = graph_source
+    # Results and the rendered network belong to the previous graph
+    st.session_state.results = None
+    st.session_state.current_timestep = 0
+    st.session_state.base_html = None
+    st.session_state.shown_colors = None
+
+if st.session_state.pos_key != st.session_state.graph_key:
+    if uploaded_file is None:
+        st.session_state.pos = get_default_pos()
+    else:
+        st.session_state.pos = compute_layout(st.session_state.graph_key, G)
+    st.session_state.pos_key = st.session_state.graph_key
+
+renderer = st.sidebar.radio(
+    "Renderer",
+    RENDERERS,
+    index=1 if G.number_of_nodes() > SIGMA_DEFAULT_NODES else 0
+)
 
 
 # -------------------------
@@ -137,6 +404,8 @@ default_propensity_verified = st.sidebar.slider("Default tendency to share (veri
 default_trust_from_verified = st.sidebar.slider("Default trust if neighbor is verified", 0.0, 1.0, 0.9, 0.05)
 default_trust_from_anonymous = st.sidebar.slider("Default trust if neighbor is anonymous", 0.0, 1.0, 0.3, 0.05)
 
+verbose = st.sidebar.checkbox("Verbose sim logs")
+
 
 # -------------------------
 # Run simulation
@@ -144,23 +413,30 @@ default_trust_from_anonymous = st.sidebar.slider("Default trust if neighbor is a
 run = st.sidebar.button("Run simulation")
 
 if run:
-    G_run = G.copy()
     st.session_state.results = simulate(
-        G_run,
+        G,
         initial_infected_list=st.session_state.initial_infected,
         timesteps=timesteps,
         default_propensity_anonymous=default_propensity_anonymous,
         default_propensity_verified=default_propensity_verified,
         default_trust_from_verified=default_trust_from_verified,
-        default_trust_from_anonymous=default_trust_from_anonymous
+        default_trust_from_anonymous=default_trust_from_anonymous,
+        verbose=verbose
     )
+    st.session_state.results_graph_key = st.session_state.graph_key
+    st.session_state.run_id += 1
     st.session_state.current_timestep = 0
+    st.session_state.base_html = None
 
 
 # -------------------------
 # Visualization
 # -------------------------
 results = st.session_state.results
+# Node-indexed results (and community membership) only line up with the
+# graph they were simulated on
+if st.session_state.results_graph_key != st.session_state.graph_key:
+    results = None
 
 if results is not None:
     st.subheader("Interactive network view")
@@ -191,24 +467,53 @@ if results is not None:
 
     infected_at_t = results["infection_history"][st.session_state.current_timestep]
 
-    net = nx_to_pyvis(G, infected_at_t, st.session_state.pos)
-
-    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-    net.save_graph(tmp_file.name)
-    with open(tmp_file.name, "r", encoding="utf-8") as f:
-        html = f.read()
-    os.unlink(tmp_file.name)
+    # Very large graphs are drawn as one meta-node per community under pyvis
+    use_sigma = renderer == RENDERERS[1]
+    coarse = not use_sigma and G.number_of_nodes() > COARSEN_THRESHOLD
+    if coarse:
+        H, H_pos, membership = coarsen_graph(st.session_state.graph_key, G, st.session_state.pos)
+        view_ids = list(H.nodes)
+        sizes = np.array([size for _, size in H.nodes(data="size")])
+        colors = community_colors(infected_at_t, membership, sizes)
+        st.caption(f"Showing {H.number_of_nodes()} communities; color intensity is the infected fraction.")
+    else:
+        view_ids = results["nodes"].tolist()
+        colors = np.where(infected_at_t, INFECTED_COLOR, UNINFECTED_COLOR)
+
+    # The full network is rendered once per run; steps only recolor nodes
+    if st.session_state.base_html is None or st.session_state.base_renderer != renderer:
+        if use_sigma:
+            st.session_state.base_html = render_sigma(
+                G, infected_at_t, st.session_state.pos, st.session_state.run_id
+            )
+        else:
+            if coarse:
+                base_html = render_coarse_html(st.session_state.graph_key, H, H_pos)
+            else:
+                base_html = render_html(
+                    st.session_state.graph_key, np.zeros_like(infected_at_t), G, st.session_state.pos
+                )
+            st.session_state.base_html = with_update_hook(
+                base_html, color_updates(view_ids, colors), st.session_state.run_id
+            )
+        st.session_state.base_renderer = renderer
+        st.session_state.shown_colors = colors
+
+    st.components.v1.html(st.session_state.base_html, height=650)
+
+    updates = color_updates(view_ids, colors, st.session_state.shown_colors)
+    if updates:
+        send_update(updates, st.session_state.current_timestep)
+        st.session_state.shown_colors = colors
 
-    st.components.v1.html(html, height=650)
     st.write(f"Current timestep: {st.session_state.current_timestep}")
 
     # Plot
     st.subheader("Infection over time")
-    fig, ax = plt.subplots()
-    ax.plot(results["time_series_total"], label="Total infected")
-    ax.plot(results["time_series_new"], label="Newly infected")
-    ax.legend()
-    st.pyplot(fig)
+    st.line_chart(pd.DataFrame({
+        "Total infected": results["time_series_total"],
+        "Newly infected": results["time_series_new"]
+    }))
 
     # Download metrics
     zip_bytes = export_simulation_metrics(results)
@@ -1,25 +1,41 @@
 import os
 import json
-import random
-from collections import defaultdict
 import networkx as nx
+import numpy as np
+import scipy.sparse as sp
 import pandas as pd
 import io
+import math
 import zipfile
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to the NumPy kernel
+    njit = None
+
 # -------------------------
 # Constants / fallback
 # -------------------------
-FALLBACK_JSON_PATH = "data/default_network.json"
+FALLBACK_JSON_PATH = "data/default_net.json"
+DEFAULT_LAYOUT_PATH = "data/default_layout.npy"
+DEFAULT_LAYOUT_NODES_PATH = "data/default_layout_nodes.json"
 
 
 # -------------------------
 # Graph initialization
 # -------------------------
+def mark_verified(G: nx.DiGraph):
+    for n, data in G.nodes(data=True):
+        data["is_verified"] = data.get("identity_type") == "verified"
+
+
 if os.path.exists(FALLBACK_JSON_PATH):
     with open(FALLBACK_JSON_PATH, "r") as f:
         data = json.load(f)
-    G = nx.node_link_graph(data, directed=True)
+    try:
+        G = nx.node_link_graph(data, directed=True, edges="links")
+    except TypeError:  # networkx < 3.4 reads "links" by default
+        G = nx.node_link_graph(data, directed=True)
 else:
     G = nx.DiGraph()
 
@@ -49,6 +65,28 @@ else:
     for u, v, attrs in example_edges:
         G.add_edge(u, v, **attrs)
 
+mark_verified(G)
+
+
+# -------------------------
+# Default layout (see scripts/precompute_layout.py)
+# -------------------------
+DEFAULT_POS = None
+if os.path.exists(DEFAULT_LAYOUT_PATH) and os.path.exists(DEFAULT_LAYOUT_NODES_PATH):
+    with open(DEFAULT_LAYOUT_NODES_PATH, "r") as f:
+        layout_nodes = json.load(f)
+    # Only reuse the layout if it was computed for exactly these nodes, in order
+    if layout_nodes == list(G.nodes):
+        DEFAULT_POS = dict(zip(G.nodes, np.load(DEFAULT_LAYOUT_PATH, mmap_mode="r")))
+
+
+def get_default_pos():
+    """Return the layout of the default network, computing it if no valid precomputed one exists."""
+    global DEFAULT_POS
+    if DEFAULT_POS is None:
+        DEFAULT_POS = nx.spring_layout(G.to_undirected(), seed=42)
+    return DEFAULT_POS
+
 
 # -------------------------
 # Helper functions
@@ -81,6 +119,24 @@ def get_infected_nodes(G: nx.DiGraph):
     return [n for n in get_nodes(G) if get_node_attr(G, n, "state") == "infected"]
 
 
+# -------------------------
+# Exposure kernel
+# -------------------------
+if njit is not None:
+    @njit(cache=True)
+    def _exposure_logsum(indptr, indices, weights, infected, tend, cred, out_logsum):
+        """Accumulate log(1 - p_exposure) per susceptible target into `out_logsum`."""
+        for u in range(indptr.shape[0] - 1):
+            if infected[u]:
+                for k in range(indptr[u], indptr[u + 1]):
+                    v = indices[k]
+                    if not infected[v]:
+                        p = min(max(cred[v] * tend[u] * weights[k], 0.0), 1.0)
+                        out_logsum[v] += math.log1p(-p)
+else:
+    _exposure_logsum = None
+
+
 # -------------------------
 # Simulation
 # -------------------------
@@ -92,93 +148,112 @@ def simulate(
     default_propensity_anonymous=0.8,
     default_propensity_verified=0.3,
     default_trust_from_verified=0.9,
-    default_trust_from_anonymous=0.3
+    default_trust_from_anonymous=0.3,
+    verbose=False
 ):
-    
-    if random_seed is not None:
-        random.seed(random_seed)
-
-    # Reset node states
-    for n, data in G.nodes(data=True):
-        set_node_attr(G, n, "state", data.get("state", "uninfected"))
-        set_node_attr(G, n, "infection_time", data.get("infection_time", None))
 
-    # Seed initial infected
+    rng = np.random.default_rng(random_seed)
+
+    # Index nodes once and pull the per-node attributes into arrays
+    nodes = list(G)
+    N = len(nodes)
+    idx = {n: i for i, n in enumerate(nodes)}
+
+    is_verified = np.empty(N, dtype=bool)
+    cred = np.empty(N)
+    tend = np.empty(N)
+    fc = np.empty(N, dtype=bool)
+    infected = np.empty(N, dtype=bool)
+    inf_time = np.full(N, -1, dtype=np.int32)
+    for i, (n, data) in enumerate(G.nodes(data=True)):
+        is_verified[i] = data.get("is_verified", data.get("identity_type") == "verified")
+        cred[i] = data.get("credulity", 0.0)
+        tend[i] = data.get("tendency_to_share", np.nan)
+        fc[i] = data.get("is_fact_checker", False)
+        infected[i] = data.get("state", "uninfected") == "infected"
+        if data.get("infection_time", None) is not None:
+            inf_time[i] = data["infection_time"]
+    tend_default = np.where(is_verified, default_propensity_verified, default_propensity_anonymous)
+    tend = np.where(np.isnan(tend), tend_default, tend)
+
+    # Sparse trust matrix: A[u, v] = effective trust of edge u -> v. Edges
+    # touching a fact-checker never carry exposure, so they are left out.
+    succ = G.succ if G.is_directed() else G.adj
+    rows, cols, weights = [], [], []
+    for u, nbrs in succ.items():
+        if fc[idx[u]]:
+            continue
+        for v, data in nbrs.items():
+            if fc[idx[v]]:
+                continue
+            trust = data.get("trust_weight", None)
+            rows.append(idx[u])
+            cols.append(idx[v])
+            weights.append(np.nan if trust is None else trust)
+    rows = np.array(rows, dtype=np.intp)
+    weights = np.array(weights, dtype=float)
+
+    # Missing trust defaults on the sender's identity
+    missing = np.isnan(weights)
+    trust_default = np.where(is_verified, default_trust_from_verified, default_trust_from_anonymous)
+    weights[missing] = trust_default[rows[missing]]
+    A = sp.csr_matrix((weights, (rows, cols)), shape=(N, N))
+    edge_src = np.repeat(np.arange(N), np.diff(A.indptr))
+    edge_dst = A.indices
+
+    # Seed the requested initial infected on top of any pre-existing state
     for s in initial_infected_list:
-        if s is not None and not get_node_attr(G, s, "is_fact_checker", False) and get_node_attr(G, s, "state", None) is not None:
-            set_node_attr(G, s, "state", "infected")
-            set_node_attr(G, s, "infection_time", 0)
+        if s is not None and s in idx and not fc[idx[s]]:
+            infected[idx[s]] = True
+            inf_time[idx[s]] = 0
 
     time_series_new = []
     time_series_total = []
-    current_infected = set(get_infected_nodes(G))
-    infection_history = [set(current_infected)]
-    time_series_new.append(len(current_infected))
-    time_series_total.append(len(current_infected))
+    infection_history = [infected.copy()]
+    n_infected = int(infected.sum())
+    time_series_new.append(n_infected)
+    time_series_total.append(n_infected)
 
-    print(f"[t=0] seeded infected: {sorted(current_infected)}")
+    if verbose:
+        print(f"[t=0] seeded infected: {sorted(nodes[i] for i in np.flatnonzero(infected))}")
 
     for t in range(1, timesteps + 1):
-        exposures = defaultdict(list)
-
-        for u in list(current_infected):
-            if get_node_attr(G, u, "is_fact_checker", False):
-                continue
-            # Determine the node's effective tendency_to_share
-            node_data = G.nodes[u]
-            u_identity = node_data.get("identity_type", "anonymous")
-            u_tendency = node_data.get(
-                "tendency_to_share",
-                default_propensity_anonymous if u_identity == "anonymous" else default_propensity_verified
-            )
-
-            for v in neighbors(G, u):
-                if get_node_attr(G, v, "is_fact_checker", False):
-                    continue
-                v_state = get_node_attr(G, v, "state", "uninfected")
-                if v_state == "uninfected":
-                    cred_v = get_node_attr(G, v, "credulity", 0.0)
-                    
-                    # Determine effective trust for this edge
-                    trust = get_edge_attr(G, u, v, "trust_weight", None)
-                    if trust is None:
-                        neighbor_identity = G.nodes[u].get("identity_type", "anonymous")
-                        trust = default_trust_from_verified if neighbor_identity == "verified" else default_trust_from_anonymous
-
-                    # Probability of exposure
-                    p_exposure = cred_v * u_tendency * trust
-                    if p_exposure > 0:
-                        exposures[v].append(p_exposure)
-
-        newly_infected = []
-        for v, p_list in exposures.items():
-            prob_no = 1.0
-            for p_i in p_list:
-                prob_no *= (1.0 - p_i)
-            p_total = 1.0 - prob_no
-            if random.random() < p_total:
-                newly_infected.append(v)
-
-        for v in newly_infected:
-            set_node_attr(G, v, "state", "infected")
-            set_node_attr(G, v, "infection_time", t)
-
-        current_infected = set(get_infected_nodes(G))
-        infection_history.append(set(current_infected))
-        time_series_new.append(len(newly_infected))
-        time_series_total.append(len(current_infected))
-        print(f"[t={t}] newly infected: {sorted(newly_infected)}; total infected: {len(current_infected)}")
-
-    infection_times = {n: get_node_attr(G, n, "infection_time") for n in get_nodes(G)}
+        # p_total = 1 - prod(1 - p_i), accumulated per target in log space
+        if _exposure_logsum is not None:
+            log_no = np.zeros(N)
+            _exposure_logsum(A.indptr, A.indices, A.data, infected, tend, cred, log_no)
+        else:
+            # Exposures along edges from infected spreaders to susceptible targets
+            active = infected[edge_src] & ~infected[edge_dst]
+            src, dst = edge_src[active], edge_dst[active]
+            p_exposure = np.clip(cred[dst] * tend[src] * A.data[active], 0.0, 1.0)
+            with np.errstate(divide="ignore"):
+                log_no = np.bincount(dst, weights=np.log1p(-p_exposure), minlength=N)
+        p_total = 1.0 - np.exp(log_no)
+
+        draws = rng.random(N)
+        newly = ~infected & ~fc & (draws < p_total)
+        infected |= newly
+
+        inf_time[newly] = t
+
+        infection_history.append(infected.copy())
+        n_infected = int(infected.sum())
+        time_series_new.append(int(newly.sum()))
+        time_series_total.append(n_infected)
+        if verbose:
+            newly_infected = [nodes[i] for i in np.flatnonzero(newly)]
+            print(f"[t={t}] newly infected: {sorted(newly_infected)}; total infected: {n_infected}")
 
     return {
+        "nodes": np.fromiter(nodes, dtype=object, count=N),
         "time_series_new": time_series_new,
         "time_series_total": time_series_total,
-        "infection_times": infection_times,
-        "infection_history": infection_history,
-        "final_infected": [n for n, it in infection_times.items() if it is not None]
+        "infection_times": inf_time,
+        "infection_history": infection_history
     }
 
+
 # -------------------------
 # Export simulation metrics
 # -------------------------
@@ -190,30 +265,29 @@ def export_simulation_metrics(results):
     - final_infected.csv: list of nodes infected at the end
     """
     zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, mode="w") as zf:
+    with zipfile.ZipFile(zip_buffer, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
         # 1. Time series
         df_times = pd.DataFrame({
             "timestep": list(range(len(results["time_series_total"]))),
             "newly_infected": results["time_series_new"],
             "total_infected": results["time_series_total"]
         })
-        csv_buffer = io.StringIO()
-        df_times.to_csv(csv_buffer, index=False)
-        zf.writestr("time_series.csv", csv_buffer.getvalue())
+        with zf.open("time_series.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as tw:
+            df_times.to_csv(tw, index=False)
 
         # 2. Infection times
-        df_infection_times = pd.DataFrame.from_dict(
-            results["infection_times"], orient="index", columns=["infection_time"]
-        ).reset_index().rename(columns={"index": "node"})
-        csv_buffer = io.StringIO()
-        df_infection_times.to_csv(csv_buffer, index=False)
-        zf.writestr("infection_times.csv", csv_buffer.getvalue())
+        infected_mask = results["infection_times"] >= 0
+        df_infection_times = pd.DataFrame({
+            "node": results["nodes"],
+            "infection_time": pd.Series(results["infection_times"], dtype="Int32").mask(~infected_mask)
+        })
+        with zf.open("infection_times.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as tw:
+            df_infection_times.to_csv(tw, index=False, na_rep="")
 
         # 3. Final infected nodes
-        df_final = pd.DataFrame({"final_infected": results["final_infected"]})
-        csv_buffer = io.StringIO()
-        df_final.to_csv(csv_buffer, index=False)
-        zf.writestr("final_infected.csv", csv_buffer.getvalue())
+        df_final = pd.DataFrame({"final_infected": results["nodes"][infected_mask]})
+        with zf.open("final_infected.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as tw:
+            df_final.to_csv(tw, index=False)
 
     zip_buffer.seek(0)
     return zip_buffer.getvalue()  # bytes ready for download
@@ -0,0 +1,28 @@
+"""
+Precompute the spring layout of the default network and save it to
+data/default_layout.npy, with the matching node order in
+data/default_layout_nodes.json, so the app can skip the layout on first load.
+
+Run from the repository root:
+
+    python scripts/precompute_layout.py
+"""
+import os
+import sys
+import json
+
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import G, DEFAULT_LAYOUT_PATH, DEFAULT_LAYOUT_NODES_PATH
+
+
+if __name__ == "__main__":
+    pos = nx.spring_layout(G.to_undirected(), seed=42)
+    arr = np.array([pos[n] for n in G.nodes])
+    np.save(DEFAULT_LAYOUT_PATH, arr)
+    with open(DEFAULT_LAYOUT_NODES_PATH, "w") as f:
+        json.dump(list(G.nodes), f)
+    print(f"Saved layout for {len(arr)} nodes to {DEFAULT_LAYOUT_PATH}")